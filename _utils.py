@@ -0,0 +1,68 @@
+import re
+import pandas as pd
+
+# Date format used by the offenses data files (e.g. '2012-09-18')
+DATE_FORMAT = 'ISO8601'
+
+# Year and month counts in durations like '1 Year 4 Months', compiled once at import
+YEARS_PATTERN = re.compile(r'(\d+)\s*Year')
+MONTHS_PATTERN = re.compile(r'(\d+)\s*Month')
+
+
+def normalize_columns(df):
+    """
+    Normalize the column names of a DataFrame: strip spaces, convert to lowercase, and replace spaces and hyphens with underscores.
+    :param df: pandas DataFrame, modified in place
+    :return: The same DataFrame with normalized column names
+    """
+    df.columns = [col.strip().lower().replace(' ', '_').replace('-', '_') for col in df.columns]
+
+    return df
+
+
+def parse_dates(series, date_format=DATE_FORMAT):
+    """
+    Convert a column of date strings to datetime using an explicit format.
+    Values that don't match the format are parsed again with format='mixed'; anything still invalid becomes NaT.
+    :param series: pandas Series of date strings
+    :param date_format: Expected format of the dates
+    :return: pandas Series of datetimes
+    """
+    dates = pd.to_datetime(series, format=date_format, errors='coerce', cache=True)
+
+    # Fall back to per-value format inference only for the values the fast path couldn't parse.
+    # This is slow, and ambiguous values are read month first (so '04/13/2020' is April 13th)
+    # unless that is impossible ('13/04/2020' is silently read day first).
+    unparsed = dates.isna() & series.notna()
+    if unparsed.any():
+        dates[unparsed] = pd.to_datetime(series[unparsed], format='mixed', errors='coerce', cache=True)
+
+    return dates
+
+
+def convert_to_months(series):
+    """
+    Convert a column of time strings like '1 Year 4 Months' to total months.
+    :param series: pandas Series of durations in the format 'X Year(s) Y Month(s)'
+    :return: NumPy array of total months; values that are not strings or don't match count as 0
+    """
+    # Python-backed strings, so the precompiled patterns go straight to the re module
+    time_str = series.astype(pd.StringDtype('python'))
+    years = pd.to_numeric(time_str.str.extract(YEARS_PATTERN, expand=False), errors='coerce').fillna(0).astype('int32')
+    months = pd.to_numeric(time_str.str.extract(MONTHS_PATTERN, expand=False), errors='coerce').fillna(0).astype('int32')
+
+    return years.to_numpy() * 12 + months.to_numpy()
+
+
+def shrink_numeric(df):
+    """
+    Downcast the integer and float columns of a DataFrame to the smallest dtype that holds their values.
+    :param df: pandas DataFrame, modified in place
+    :return: The same DataFrame with downcast numeric columns
+    """
+    for col in df.select_dtypes(include='integer').columns:
+        df[col] = pd.to_numeric(df[col], downcast='integer')
+    for col in df.select_dtypes(include='float').columns:
+        df[col] = pd.to_numeric(df[col], downcast='float')
+
+    return df
@@ -1,4 +1,18 @@
+import re
+from concurrent.futures import ThreadPoolExecutor
 import pandas as pd
+from _utils import convert_to_months, normalize_columns, parse_dates, shrink_numeric
+from prior_summary import offense_lists_to_python, summarize_prior_commitments_file
+
+# Join key and repeated text columns stored as categoricals (integer codes instead of Python strings)
+CATEGORICAL_COLUMNS = ['cdcno', 'sex', 'race', 'offense_category', 'offense_description']
+
+# Date columns, with or without a join suffix (e.g. 'offense_begin_date_x', 'first_commitment_date_prior'),
+# but not counts such as 'total_release_dates_prior'
+DATE_COLUMN_PATTERN = re.compile(r'_date(_|$)')
+
+# Columns holding a list per row, which are left missing instead of being filled with 'Unknown'
+LIST_COLUMNS = ['offenses_description_list_prior']
 
 def load_data(demographics_file, commitments_file):
     """
@@ -7,20 +21,46 @@ def load_data(demographics_file, commitments_file):
     :param commitments_file: Path to the current commitments data file
     :return: pandas DataFrames with the loaded data
     """
-    # Load the files into DataFrames
-    demographics_df = pd.read_csv(demographics_file, low_memory=False)
-    commitments_df = pd.read_csv(commitments_file, low_memory=False)
+    # Load the files into DataFrames concurrently; the pyarrow CSV parser releases the GIL while parsing
+    with ThreadPoolExecutor(max_workers=2) as executor:
+        demographics_future = executor.submit(pd.read_csv, demographics_file, engine='pyarrow')
+        commitments_future = executor.submit(pd.read_csv, commitments_file, engine='pyarrow')
+        demographics_df = demographics_future.result()
+        commitments_df = commitments_future.result()
 
-    # Clean column names: strip spaces and convert to lowercase
-    demographics_df.columns = demographics_df.columns.str.strip().str.lower()
-    commitments_df.columns = commitments_df.columns.str.strip().str.lower()
+    # Clean column names: strip spaces, convert to lowercase, and replace spaces and hyphens with underscores
+    demographics_df = normalize_columns(demographics_df)
+    commitments_df = normalize_columns(commitments_df)
 
     # Print column names for debugging (to ensure 'cdcno' exists in both)
     print("Demographics Columns:", demographics_df.columns)
     print("Commitments Columns:", commitments_df.columns)
+
+    # Downcast numeric columns to shrink the frames before merging
+    demographics_df = shrink_numeric(demographics_df)
+    commitments_df = shrink_numeric(commitments_df)
+
+    # Convert the join key and repeated text columns to categoricals
+    for df in (demographics_df, commitments_df):
+        for col in CATEGORICAL_COLUMNS:
+            if col in df.columns:
+                df[col] = df[col].astype('category')
     
     return demographics_df, commitments_df
 
+def align_cdcno_categories(*dfs):
+    """
+    Give the 'cdcno' column of every DataFrame the same categorical dtype, so joins compare category codes.
+    :param dfs: DataFrames with a 'cdcno' column
+    :return: List of DataFrames with the aligned 'cdcno' column
+    """
+    categories = dfs[0]['cdcno'].astype('category').cat.categories
+    for df in dfs[1:]:
+        categories = categories.union(df['cdcno'].astype('category').cat.categories)
+    cdcno_dtype = pd.CategoricalDtype(categories)
+
+    return [df.assign(cdcno=df['cdcno'].astype(cdcno_dtype)) for df in dfs]
+
 def merge_data(demographics_df, commitments_df):
     """
     Perform a left join of commitments with demographics data based on 'cdcno'.
@@ -36,8 +76,11 @@ def merge_data(demographics_df, commitments_df):
         print("Error: 'cdcno' column missing in commitments data")
         return None
 
-    # Merge the DataFrames on the 'cdcno' column using a left join (keep all commitments)
-    merged_df = pd.merge(commitments_df, demographics_df, on='cdcno', how='left')
+    # Share one categorical dtype for 'cdcno' so the join compares category codes
+    commitments_df, demographics_df = align_cdcno_categories(commitments_df, demographics_df)
+
+    # Index demographics on 'cdcno' and join it onto the commitments (keep all commitments)
+    merged_df = commitments_df.join(demographics_df.set_index('cdcno'), on='cdcno', how='left', lsuffix='_x', rsuffix='_y')
 
     print(f"Merged DataFrame has {merged_df.shape[0]} rows and {merged_df.shape[1]} columns")
     
@@ -58,8 +101,11 @@ def merge_with_prior_summary(merged_df, prior_summary_df):
         print("Error: 'cdcno' column missing in prior summary data")
         return None
 
-    # Merge the DataFrames on the 'cdcno' column using a left join (keep all merged data)
-    final_df = pd.merge(merged_df, prior_summary_df, on='cdcno', how='left')
+    # Share one categorical dtype for 'cdcno' so the join compares category codes
+    merged_df, prior_summary_df = align_cdcno_categories(merged_df, prior_summary_df)
+
+    # Index the prior summary on 'cdcno' and join it onto the merged data (keep all merged data)
+    final_df = merged_df.join(prior_summary_df.set_index('cdcno'), on='cdcno', how='left', lsuffix='_x', rsuffix='_y')
 
     print(f"Final DataFrame has {final_df.shape[0]} rows and {final_df.shape[1]} columns")
     
@@ -71,28 +117,39 @@ def clean_data(merged_df):
     :param merged_df: Merged DataFrame
     :return: Cleaned DataFrame
     """
-    # Convert categorical columns to object before filling missing values
+    # Convert every date column to datetime format, all in one apply. This includes the '_x'/'_y' copies
+    # the join makes of dates found in both demographics and commitments; the pyarrow reader returns those
+    # as object columns of datetime.date, which must not be mixed with the 'Unknown' fill below.
+    date_columns = [
+        col for col in merged_df.columns
+        if DATE_COLUMN_PATTERN.search(col) and not pd.api.types.is_numeric_dtype(merged_df[col])
+    ]
+    merged_df[date_columns] = merged_df[date_columns].apply(parse_dates)
+
+    # Ensure that sentence columns are numeric (and handle any non-numeric values)
+    numeric_columns = ['aggregate_sentence_in_months']
+    for col in numeric_columns:
+        if col not in merged_df.columns:
+            print(f"Warning: '{col}' column is missing. Skipping conversion.")
+    numeric_columns = [col for col in numeric_columns if col in merged_df.columns]
+    merged_df[numeric_columns] = merged_df[numeric_columns].apply(pd.to_numeric, errors='coerce')
+
+    # Fill missing text values with 'Unknown'. Numeric and date columns keep their NaN/NaT,
+    # so they aren't turned into object columns.
     for col in merged_df.select_dtypes(include=['category']).columns:
-        merged_df[col] = merged_df[col].astype('object')
-    
-    # Fill missing values with 'Unknown'
-    merged_df.fillna('Unknown', inplace=True)
-
-    # Convert date columns to datetime format (if applicable)
-    date_columns = ['offense_begin_date', 'offense_end_date']
-    for date_col in date_columns:
-        if date_col in merged_df.columns:
-            merged_df[date_col] = pd.to_datetime(merged_df[date_col], errors='coerce')
-
-    # Ensure that sentence columns are integers (and handle any non-integer values)
-    if 'aggregate_sentence_in_months' in merged_df.columns:
-        merged_df['aggregate_sentence_in_months'] = pd.to_numeric(merged_df['aggregate_sentence_in_months'], errors='coerce')
-    else:
-        print("Warning: 'aggregate_sentence_in_months' column is missing. Skipping conversion.")
-    
-    # Similarly for 'offense_time_with_enhancement'
+        if 'Unknown' not in merged_df[col].cat.categories:
+            merged_df[col] = merged_df[col].cat.add_categories(['Unknown'])
+        merged_df[col] = merged_df[col].fillna('Unknown')
+
+    text_columns = [
+        col for col in merged_df.select_dtypes(include=['object', 'string']).columns
+        if col not in LIST_COLUMNS and col not in date_columns
+    ]
+    merged_df[text_columns] = merged_df[text_columns].fillna('Unknown')
+
+    # 'offense_time_with_enhancement' holds durations like '1 Year 4 Months', so add them as total months
     if 'offense_time_with_enhancement' in merged_df.columns:
-        merged_df['offense_time_with_enhancement'] = pd.to_numeric(merged_df['offense_time_with_enhancement'], errors='coerce')
+        merged_df['offense_time_with_enhancement_months'] = convert_to_months(merged_df['offense_time_with_enhancement'])
     else:
         print("Warning: 'offense_time_with_enhancement' column is missing. Skipping conversion.")
     
@@ -100,12 +157,15 @@ def clean_data(merged_df):
 
 def save_data(merged_df, output_file):
     """
-    Save the cleaned DataFrame to a CSV file.
+    Save the cleaned DataFrame to a CSV, Parquet or Excel file, based on the file extension.
     :param merged_df: Cleaned DataFrame
     :param output_file: Path to the output file
     """
     if output_file.endswith('.csv'):
-        merged_df.to_csv(output_file, index=False)
+        # Write the prior offense lists the way prior_summary.csv does
+        offense_lists_to_python(merged_df).to_csv(output_file, index=False)
+    elif output_file.endswith('.parquet'):
+        merged_df.to_parquet(output_file, engine='pyarrow', compression='snappy', index=False)
     else:
         merged_df.to_excel(output_file, index=False)
 
@@ -113,34 +173,45 @@ def main():
     # Specify the full paths to the input files
     demographics_file = './data/data/demographics.csv'  # Path to demographics file
     commitments_file = './data/data/current_commitments.csv'  # Path to current commitments file
-    prior_summary_file = './data/data/prior_commitments.csv'  # Path to prior summary file
+    prior_commitments_file = './data/data/prior_commitments.csv'  # Path to prior commitments file
     
     # Specify the output file path for cleaned data
-    output_file = './data/data/merged_data.csv'  # Path to save merged data
+    output_file = './data/data/merged_data.parquet'  # Path to save merged data
+
+    # Step 1: Load the data, summarizing the prior commitments by individual in the background at the same time
+    with ThreadPoolExecutor(max_workers=1) as executor:
+        prior_summary_future = executor.submit(summarize_prior_commitments_file, prior_commitments_file)
+        demographics_df, commitments_df = load_data(demographics_file, commitments_file)
+        prior_summary_df = prior_summary_future.result()
+
+    if prior_summary_df is None:
+        print("Error: Could not load or process the prior commitments data.")
+        return
+
+    # Check that 'cdcno' is in every DataFrame before joining
+    for name, df in (('demographics', demographics_df), ('commitments', commitments_df), ('prior summary', prior_summary_df)):
+        if 'cdcno' not in df.columns:
+            print(f"Error: 'cdcno' column missing in {name} data")
+            return
+
+    # Step 2: Index both lookup tables on 'cdcno' once and left-join them onto the commitments
+    commitments_df, demographics_df, prior_summary_df = align_cdcno_categories(commitments_df, demographics_df, prior_summary_df)
+    demographics_df = demographics_df.set_index('cdcno')
+    prior_summary_df = prior_summary_df.set_index('cdcno')
+    final_df = (
+        commitments_df
+        .join(demographics_df, on='cdcno', how='left', lsuffix='_x', rsuffix='_y')
+        .join(prior_summary_df, on='cdcno', how='left', lsuffix='_x', rsuffix='_y')
+    )
+    print(f"Final DataFrame has {final_df.shape[0]} rows and {final_df.shape[1]} columns")
 
-    # Step 1: Load the data
-    demographics_df, commitments_df = load_data(demographics_file, commitments_file)
-    
-    # Load the prior summary file
-    prior_summary_df = pd.read_csv(prior_summary_file, low_memory=False)
-    prior_summary_df.columns = prior_summary_df.columns.str.strip().str.lower()
+    if final_df.shape[0] > 0:
+        # Step 3: Clean the merged data
+        cleaned_df = clean_data(final_df)
 
-    # Step 2: Merge the data
-    merged_df = merge_data(demographics_df, commitments_df)
-    
-    if merged_df is not None and merged_df.shape[0] > 0:
-        # Step 3: Merge with prior commitments summary
-        final_df = merge_with_prior_summary(merged_df, prior_summary_df)
-        
-        if final_df is not None:
-            # Step 4: Clean the merged data
-            cleaned_df = clean_data(final_df)
-            
-            # Step 5: Save the cleaned data to file
-            save_data(cleaned_df, output_file)
-            print(f"Cleaned data saved to {output_file}")
-        else:
-            print("No data to merge with prior summary.")
+        # Step 4: Save the cleaned data to file
+        save_data(cleaned_df, output_file)
+        print(f"Cleaned data saved to {output_file}")
     else:
         print("No data to clean or merge.")
 
@@ -1,30 +1,18 @@
 import pandas as pd
-import re
+import numpy as np
 import os
 import logging
+import matplotlib
+matplotlib.use('Agg')  # Render plots to files without a GUI backend
 import matplotlib.pyplot as plt
 import seaborn as sns
+from _utils import convert_to_months, normalize_columns, parse_dates, shrink_numeric
 
 # Configure logging
 logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
 
-
-def convert_to_months(time_str):
-    """
-    Convert a time string like '1 Year 4 Months' to total months.
-    :param time_str: Time duration string in the format 'X Year(s) Y Month(s)'
-    :return: Total months as an integer
-    """
-    if isinstance(time_str, str):
-        years_match = re.search(r'(\d+)\s*Year', time_str)
-        months_match = re.search(r'(\d+)\s*Month', time_str)
-
-        years = int(years_match.group(1)) if years_match else 0
-        months = int(months_match.group(1)) if months_match else 0
-
-        total_months = years * 12 + months
-        return total_months
-    return 0  # If time_str is not a string or doesn't match, return 0
+# Resolution of the saved plot images
+PLOT_DPI = 90
 
 
 def load_and_clean_data(file_path):
@@ -35,33 +23,31 @@ def load_and_clean_data(file_path):
     """
     ext = os.path.splitext(file_path)[1]
     if ext == '.csv':
-        df = pd.read_csv(file_path, low_memory=False)
+        df = pd.read_csv(file_path, engine='pyarrow')
     elif ext == '.xlsx':
         df = pd.read_excel(file_path)
     else:
         raise ValueError(f"Unsupported file type: {ext}")
 
-    df.columns = (
-        df.columns.str.strip().str.lower().str.replace(' ', '_').str.replace('-', '_')
-    )
+    df = normalize_columns(df)
 
     logging.info(f"Loaded data with columns: {df.columns.tolist()}")
 
     # Convert dates to datetime
-    df['offense_begin_date'] = pd.to_datetime(df['offense_begin_date'], errors='coerce')
-    df['offense_end_date'] = pd.to_datetime(df['offense_end_date'], errors='coerce')
+    df['offense_begin_date'] = parse_dates(df['offense_begin_date'])
+    df['offense_end_date'] = parse_dates(df['offense_end_date'])
 
-    # Convert 'offense_time_with_enhancement' to total months
-    df['offense_time_with_enhancement_months'] = df['offense_time_with_enhancement'].apply(convert_to_months)
+    # Convert 'offense_time_with_enhancement' (e.g. '1 Year 4 Months') to total months
+    df['offense_time_with_enhancement_months'] = convert_to_months(df['offense_time_with_enhancement'])
 
-    # Add column for years
-    df['offense_time_with_enhancement_years'] = df['offense_time_with_enhancement_months'] / 12
+    # Add column for years, stored as float32 (half the size of the float64 a plain division gives)
+    df['offense_time_with_enhancement_years'] = df['offense_time_with_enhancement_months'].to_numpy(dtype=np.float32) / np.float32(12)
 
-    # Drop duplicates
-    df = df.drop_duplicates()
+    # Drop exact duplicate rows and reset the index in the same step
+    df = df.drop_duplicates(ignore_index=True)
 
-    # Reset index
-    df.reset_index(drop=True, inplace=True)
+    # Downcast numeric columns to the smallest dtype that fits
+    df = shrink_numeric(df)
 
     logging.info("Data cleaning completed.")
     return df
@@ -73,12 +59,15 @@ def summarize_data(df):
     :param df: pandas DataFrame
     :return: None
     """
+    # Compute the sentence duration statistics together in a single call
+    duration_stats = df['offense_time_with_enhancement_years'].agg(['mean', 'max', 'min'])
+
     summary = {
         'Total Records': len(df),
         'Unique Individuals (cdcno)': df['cdcno'].nunique(),
-        'Average Sentence Duration (Years)': df['offense_time_with_enhancement_years'].mean(),
-        'Longest Sentence Duration (Years)': df['offense_time_with_enhancement_years'].max(),
-        'Shortest Sentence Duration (Years)': df['offense_time_with_enhancement_years'].min(),
+        'Average Sentence Duration (Years)': duration_stats['mean'],
+        'Longest Sentence Duration (Years)': duration_stats['max'],
+        'Shortest Sentence Duration (Years)': duration_stats['min'],
         'Most Frequent Offense': df['offense_description'].mode()[0],
         'Offense Categories Count': df['offense_category'].value_counts().to_dict()
     }
@@ -96,45 +85,51 @@ def visualize_data(df, save_dir="plots"):
     """
     os.makedirs(save_dir, exist_ok=True)
 
+    # Draw every plot on one reused figure, clearing the axes in between
+    fig, ax = plt.subplots()
+
     # Distribution of Sentence Durations in Years
-    plt.figure(figsize=(10, 6))
-    sns.histplot(df['offense_time_with_enhancement_years'], bins=20, kde=True)
-    plt.title('Distribution of Sentence Durations (Years)')
-    plt.xlabel('Sentence Duration (Years)')
-    plt.ylabel('Frequency')
-    plt.savefig(os.path.join(save_dir, "sentence_durations_distribution_years.png"))
-    plt.close()
+    fig.set_size_inches(10, 6)
+    sns.histplot(df['offense_time_with_enhancement_years'], bins=20, kde=True, ax=ax)
+    ax.set_title('Distribution of Sentence Durations (Years)')
+    ax.set_xlabel('Sentence Duration (Years)')
+    ax.set_ylabel('Frequency')
+    fig.savefig(os.path.join(save_dir, "sentence_durations_distribution_years.png"), dpi=PLOT_DPI, bbox_inches='tight')
+    ax.clear()
 
     # Offense Categories Count
-    plt.figure(figsize=(12, 8))
-    df['offense_category'].value_counts().plot(kind='bar', color='skyblue')
-    plt.title('Frequency of Offense Categories')
-    plt.xlabel('Offense Category')
-    plt.ylabel('Count')
-    plt.xticks(rotation=45)
-    plt.savefig(os.path.join(save_dir, "offense_categories_count.png"))
-    plt.close()
+    fig.set_size_inches(12, 8)
+    df['offense_category'].value_counts().plot(kind='bar', color='skyblue', ax=ax)
+    ax.set_title('Frequency of Offense Categories')
+    ax.set_xlabel('Offense Category')
+    ax.set_ylabel('Count')
+    ax.tick_params(axis='x', labelrotation=45)
+    fig.savefig(os.path.join(save_dir, "offense_categories_count.png"), dpi=PLOT_DPI, bbox_inches='tight')
+    ax.clear()
 
     # Sentence Durations by Offense Category in Years
-    plt.figure(figsize=(14, 8))
-    sns.boxplot(x='offense_category', y='offense_time_with_enhancement_years', data=df)
-    plt.title('Sentence Durations by Offense Category (Years)')
-    plt.xlabel('Offense Category')
-    plt.ylabel('Sentence Duration (Years)')
-    plt.xticks(rotation=45)
-    plt.savefig(os.path.join(save_dir, "sentence_durations_by_category_years.png"))
-    plt.close()
+    fig.set_size_inches(14, 8)
+    sns.boxplot(x='offense_category', y='offense_time_with_enhancement_years', data=df, ax=ax)
+    ax.set_title('Sentence Durations by Offense Category (Years)')
+    ax.set_xlabel('Offense Category')
+    ax.set_ylabel('Sentence Duration (Years)')
+    ax.tick_params(axis='x', labelrotation=45)
+    fig.savefig(os.path.join(save_dir, "sentence_durations_by_category_years.png"), dpi=PLOT_DPI, bbox_inches='tight')
+    plt.close(fig)
 
     logging.info(f"Plots saved in directory: {save_dir}")
 
 
 def save_cleaned_data(df, output_file):
     """
-    Save the cleaned data to a CSV file.
+    Save the cleaned data to a CSV file, or to Parquet if the path ends in '.parquet'.
     :param df: Cleaned pandas DataFrame
-    :param output_file: Path to save the CSV
+    :param output_file: Path to save the CSV or Parquet file
     """
-    df.to_csv(output_file, index=False)
+    if output_file.endswith('.parquet'):
+        df.to_parquet(output_file, engine='pyarrow', compression='snappy', index=False)
+    else:
+        df.to_csv(output_file, index=False)
     logging.info(f"Cleaned data saved to {output_file}")
 
 
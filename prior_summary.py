@@ -1,32 +1,13 @@
 import pandas as pd
-import re
-import os
-import pathlib
-import pandas as pd
-import re
-import os
-import pathlib
-
-def convert_to_months(time_str):
-    """
-    Convert a time string like '1 Year 4 Months' to the total number of months.
-    :param time_str: Time duration string in the format 'X Year(s) Y Month(s)'
-    :return: Total months as an integer
-    """
-    if isinstance(time_str, str):
-        # Regular expression to capture the years and months
-        years_match = re.search(r'(\d+)\s*Year', time_str)
-        months_match = re.search(r'(\d+)\s*Month', time_str)
-        
-        # Extract years and months from the matched groups
-        years = int(years_match.group(1)) if years_match else 0
-        months = int(months_match.group(1)) if months_match else 0
-        
-        # Calculate total months: years * 12 + months
-        total_months = years * 12 + months
-        
-        return total_months
-    return 0  # If time_str is not a string or doesn't match, return 0
+import numpy as np
+import polars as pl
+from _utils import convert_to_months, normalize_columns, parse_dates, shrink_numeric
+
+# Rows read per chunk when summarizing a prior commitments file
+CHUNKSIZE = 500_000
+
+# Columns of the cleaned prior commitments data used by the summary
+SUMMARY_COLUMNS = ['cdcno', 'offense_description', 'offense_begin_date', 'offense_end_date', 'release_date', 'offense_time_with_enhancement_months']
 
 def load_prior_commitments(file_path):
     """
@@ -34,11 +15,20 @@ def load_prior_commitments(file_path):
     :param file_path: Path to the prior commitments data file
     :return: pandas DataFrame with the loaded data
     """
-    # Load the file into a DataFrame
-    df = pd.read_csv(file_path, low_memory=False)
+    # Load the file into a DataFrame using the multi-threaded pyarrow CSV parser
+    df = pd.read_csv(file_path, engine='pyarrow')
+
+    return clean_prior_commitments(df)
 
-    # Clean column names: strip spaces, convert to lowercase, and replace spaces with underscores
-    df.columns = df.columns.str.strip().str.lower().str.replace(' ', '_')
+
+def clean_prior_commitments(df):
+    """
+    Clean raw prior commitments data (a whole file or one chunk of it).
+    :param df: pandas DataFrame with the raw prior commitments data
+    :return: Cleaned pandas DataFrame, or None if required columns are missing
+    """
+    # Clean column names: strip spaces, convert to lowercase, and replace spaces and hyphens with underscores
+    df = normalize_columns(df)
 
     # Check if the necessary columns exist before proceeding
     required_columns = ['cdcno', 'offense_begin_date', 'offense_end_date', 'release_date', 'offense_time_with_enhancement', 'offense_description']
@@ -48,52 +38,170 @@ def load_prior_commitments(file_path):
         return None
 
     # Convert relevant columns to datetime, explicitly ensuring the conversion works
-    df['offense_begin_date'] = pd.to_datetime(df['offense_begin_date'], errors='coerce')
-    df['offense_end_date'] = pd.to_datetime(df['offense_end_date'], errors='coerce')
-    df['release_date'] = pd.to_datetime(df['release_date'], errors='coerce')
+    df['offense_begin_date'] = parse_dates(df['offense_begin_date'])
+    df['offense_end_date'] = parse_dates(df['offense_end_date'])
+    df['release_date'] = parse_dates(df['release_date'])
 
-    # Ensure 'offense_time_with_enhancement' is numeric (convert from text if necessary)
-    df['offense_time_with_enhancement_months'] = df['offense_time_with_enhancement'].apply(convert_to_months)
+    # Convert 'offense_time_with_enhancement' (e.g. '1 Year 4 Months') to total months
+    df['offense_time_with_enhancement_months'] = convert_to_months(df['offense_time_with_enhancement'])
 
     # Calculate the difference in days
     df['diff_in_days'] = (df['offense_end_date'] - df['offense_begin_date']).dt.days
 
-    # Calculate the difference in months using 365.25 days per year (dividing by 30.4375 to get months)
-    df['diff_in_months'] = df['diff_in_days'] / 30.4375
+    # Calculate the difference in months using 365.25 days per year (dividing by 30.4375 to get months).
+    # np.fmax clamps negative differences and missing dates (NaN) to 0 in the same vectorized pass.
+    diff_in_months = df['diff_in_days'].to_numpy(dtype=np.float32) / np.float32(30.4375)
+    df['diff_in_months'] = np.fmax(diff_in_months, np.float32(0.0))
 
-    # Fix edge cases where difference is negative or zero due to invalid dates
-    df['diff_in_months'] = df['diff_in_months'].apply(lambda x: max(0.0, x))
+    # Downcast numeric columns to the smallest dtype that fits
+    df = shrink_numeric(df)
 
     return df
 
 
+def _partial_summary(prior_commitments_df):
+    """
+    Aggregate one chunk of cleaned prior commitments by individual into partial results.
+    :param prior_commitments_df: DataFrame with (a chunk of) cleaned prior commitments data
+    :return: Tuple of Polars DataFrames (partial aggregates, distinct cdcno/release date pairs),
+             to be reduced by _combine_partial_summaries
+    """
+    commitments = (
+        pl.from_pandas(prior_commitments_df[SUMMARY_COLUMNS])
+        .lazy()
+        .filter(pl.col('cdcno').is_not_null())
+        .with_columns(pl.col('offense_description').cast(pl.String))
+    )
+
+    # Polars builds the per-individual offense lists natively instead of calling a Python function for every group
+    aggregates = (
+        commitments
+        .group_by('cdcno')
+        .agg(
+            pl.len().alias('total_commitments_prior'),  # Count occurrences (i.e., number of commitments)
+            pl.col('offense_description').alias('offenses_description_list_prior'),  # List of offense descriptions for each individual
+            pl.col('offense_begin_date').min().alias('first_commitment_date_prior'),  # First offense date
+            pl.col('offense_end_date').max().alias('last_commitment_date_prior'),  # Last offense date
+            pl.col('offense_time_with_enhancement_months').sum().alias('total_commitment_duration_months_prior'),  # Sum of commitment durations in months
+            pl.col('offense_time_with_enhancement_months').count().alias('duration_count')  # Number of durations, for the average
+        )
+        .collect()
+    )
+
+    # Distinct release dates are deduplicated over the whole frame and counted after combining,
+    # instead of running a unique count inside every group
+    release_dates = (
+        commitments
+        .select('cdcno', 'release_date')
+        .filter(pl.col('release_date').is_not_null())
+        .unique()
+        .collect()
+    )
+
+    return aggregates, release_dates
+
+
+def _combine_partial_summaries(partials):
+    """
+    Reduce the partial aggregates of one or more chunks into the final summary by individual.
+    :param partials: List of tuples returned by _partial_summary
+    :return: Summary pandas DataFrame
+    """
+    aggregates, release_dates = zip(*partials)
+
+    # Number of distinct release dates per individual
+    total_release_dates = (
+        pl.concat(release_dates, how='vertical_relaxed')
+        .lazy()
+        .unique()
+        .group_by('cdcno')
+        .len(name='total_release_dates_prior')
+    )
+
+    summary = (
+        pl.concat(aggregates, how='vertical_relaxed')
+        .lazy()
+        .group_by('cdcno')
+        .agg(
+            pl.col('total_commitments_prior').sum(),
+            pl.col('offenses_description_list_prior').explode(),
+            pl.col('first_commitment_date_prior').min(),
+            pl.col('last_commitment_date_prior').max(),
+            pl.col('total_commitment_duration_months_prior').sum(),
+            pl.col('duration_count').sum()
+        )
+        .join(total_release_dates, on='cdcno', how='left')
+        .select(
+            'cdcno',
+            'total_commitments_prior',
+            'offenses_description_list_prior',
+            'first_commitment_date_prior',
+            'last_commitment_date_prior',
+            pl.col('total_release_dates_prior').fill_null(0),  # Individuals without any release date
+            'total_commitment_duration_months_prior',
+            (pl.col('total_commitment_duration_months_prior') / pl.col('duration_count')).alias('avg_commitment_duration_months_prior')  # Average duration in months per commitment
+        )
+        .sort('cdcno')
+        .collect()
+    )
+
+    return summary.to_pandas()
+
+
 def summarize_prior_commitments(prior_commitments_df):
     """
     Generate a summary of prior commitments by individual.
     :param prior_commitments_df: DataFrame with prior commitments data
     :return: Summary DataFrame
     """
-    # Group by 'cdcno' to summarize data
-    summary = prior_commitments_df.groupby('cdcno').agg(
-        total_commitments_prior=('case_number', 'size'),  # Count occurrences (i.e., number of commitments)
-        offenses_description_list_prior=('offense_description', lambda x: list(x)),  # List of offense descriptions for each individual
-        first_commitment_date_prior=('offense_begin_date', 'min'),  # First offense date
-        last_commitment_date_prior=('offense_end_date', 'max'),  # Last offense date
-        total_release_dates_prior=('release_date', 'nunique'),  # Number of distinct release dates
-        total_commitment_duration_months_prior=('offense_time_with_enhancement_months', 'sum'),  # Sum of commitment durations in months
-        avg_commitment_duration_months_prior=('offense_time_with_enhancement_months', 'mean')  # Average duration in months per commitment
-    ).reset_index()
+    return _combine_partial_summaries([_partial_summary(prior_commitments_df)])
 
-    return summary
+
+def summarize_prior_commitments_file(file_path, chunksize=CHUNKSIZE):
+    """
+    Load, clean and summarize the prior commitments file chunk by chunk, so only one chunk is in memory at a time.
+    :param file_path: Path to the prior commitments data file
+    :param chunksize: Number of rows read per chunk
+    :return: Summary DataFrame, or None if the data could not be processed
+    """
+    partials = []
+    # Read every column as text: the C parser guesses types per chunk, and a chunk whose CDCNos are all digits
+    # would otherwise read them as integers and drop leading zeros. The columns used are parsed from text anyway.
+    for chunk in pd.read_csv(file_path, chunksize=chunksize, dtype=str):
+        chunk = clean_prior_commitments(chunk)
+        if chunk is None:
+            return None
+        partials.append(_partial_summary(chunk))
+
+    if not partials:
+        return None
+
+    return _combine_partial_summaries(partials)
+
+
+def offense_lists_to_python(summary_df):
+    """
+    Turn the offense description lists, which Polars hands back as NumPy arrays with None for missing
+    descriptions, into Python lists with NaN, so they are written to text files the way a pandas groupby's were.
+    :param summary_df: DataFrame with summarized prior commitments data
+    :return: Copy of the DataFrame with Python lists in 'offenses_description_list_prior'
+    """
+    return summary_df.assign(offenses_description_list_prior=[
+        offenses if not isinstance(offenses, np.ndarray) else [np.nan if offense is None else offense for offense in offenses]
+        for offenses in summary_df['offenses_description_list_prior']
+    ])
 
 
 def save_summary_to_csv(summary_df, output_file):
     """
-    Save the summarized data to a CSV file.
+    Save the summarized data to a CSV file, or to Parquet if the path ends in '.parquet'.
     :param summary_df: DataFrame with summarized prior commitments data
     :param output_file: Path to save the summary file
     """
-    summary_df.to_csv(output_file, index=False)
+    if output_file.endswith('.parquet'):
+        summary_df.to_parquet(output_file, engine='pyarrow', compression='snappy', index=False)
+    else:
+        offense_lists_to_python(summary_df).to_csv(output_file, index=False)
     print(f"Summary data saved to {output_file}")
 
 
@@ -102,16 +210,13 @@ def main():
     prior_commitments_file = 'data/data/prior_commitments.csv'  # Adjusted path for the input file
     output_file = 'data/data/prior_summary.csv'  # Output file path
 
-    # Load the prior commitments data
-    prior_commitments_df = load_prior_commitments(prior_commitments_file)
-    
-    if prior_commitments_df is None:
+    # Load and summarize the prior commitments by individual, one chunk at a time
+    summary_df = summarize_prior_commitments_file(prior_commitments_file)
+
+    if summary_df is None:
         print("Error: Could not load or process the prior commitments data.")
         return
 
-    # Summarize the prior commitments by individual
-    summary_df = summarize_prior_commitments(prior_commitments_df)
-
     # Save the summarized data to CSV
     save_summary_to_csv(summary_df, output_file)
 